@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 et:
+#
+# cloudprofile.py
+#
+# Per-cloud profiling support for openstacksrv2ssh.py --profile
+#
+# (c) Kurt Garloff <kurt@garloff.de>, 1/2023
+# SPDX-License-Identifier: Apache-2.0
+
+"""Implements class CloudProfiler which records cProfile statistics
+   (and optionally tracemalloc peak and top allocation sites) per
+   processed cloud plus an aggregate for the whole run.
+   For every cloud CLOUD, DIR/CLOUD.pstats, DIR/CLOUD.collapsed
+   (collapsed stacks for flamegraph tools) and DIR/CLOUD.mem.txt
+   are written, the aggregate goes to DIR/openstacksrv2ssh.*.
+   Peak memory and allocation sites are the growth since the start of
+   the cloud (or the run), excluding the profiler's own allocations.
+   On python >= 3.12, worker thread calls are seen by the one cProfile
+   profiler of the cloud, whose single call stack mixes up concurrently
+   running threads; caller/callee attribution is approximate there.
+   Only imported if profiling is requested."""
+
+import os
+import sys
+import threading
+import cProfile
+import pstats
+import tracemalloc
+
+TOP_ALLOCS = 20
+MIN_SECS = 1e-6
+
+# Before python 3.12, cProfile only sees the thread that enabled it;
+# from 3.12 on it sees all threads, but interleaves them on one stack.
+_PER_THREAD = sys.version_info < (3, 12)
+
+
+def take_snapshot():
+    "Take tracemalloc snapshot without the allocations of profiling itself"
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, pstats.__file__),
+        tracemalloc.Filter(False, cProfile.__file__)))
+
+def func_label(func):
+    "Turn pstats function tuple into a label usable in collapsed stacks"
+    fnm, line, name = func
+    if fnm == "~" and line == 0:
+        return name.replace(";", ":")
+    return f"{name} ({os.path.basename(fnm)}:{line})".replace(";", ":")
+
+def collapsed_stacks(stats, maxdepth=64):
+    """Derive collapsed stacks (one "frame;frame;frame usecs" line each)
+       from the call graph in pstats.Stats object stats.
+       pstats does not record full stacks, so the time of a function
+       called from several places is split by its callers' shares."""
+    data = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in data.items():
+        for caller, cstat in callers.items():
+            callees.setdefault(caller, []).append((func, cstat[3]))
+    lines = {}
+
+    def walk(stack, func, share):
+        "Recursively emit self time of func reached via stack"
+        stack = stack + (func,)
+        usecs = int(data[func][2] * share * 1000000)
+        if usecs:
+            key = ";".join(map(func_label, stack))
+            lines[key] = lines.get(key, 0) + usecs
+        if len(stack) >= maxdepth:
+            return
+        for callee, edge_ct in callees.get(func, ()):
+            callee_ct = data[callee][3]
+            if callee in stack or not callee_ct or edge_ct * share < MIN_SECS:
+                continue
+            walk(stack, callee, share * edge_ct / callee_ct)
+
+    for func, (_, _, _, _, callers) in data.items():
+        if not callers:
+            walk((), func, 1.0)
+    return [f"{key} {val}" for key, val in sorted(lines.items())]
+
+
+class CloudProfiler:
+    "Record profiles per cloud and for the whole run in directory outdir"
+    def __init__(self, outdir, trace_mem=False):
+        "c'tor, creates outdir and starts tracemalloc if requested"
+        self.outdir = outdir
+        self.trace_mem = trace_mem
+        self._pstats_files = []
+        self.peak = 0
+        self._base = 0
+        self._lock = threading.Lock()
+        self._thread_profs = []
+        self._start_snap = None
+        os.makedirs(outdir, exist_ok=True)
+        if trace_mem:
+            tracemalloc.start()
+            self._start_snap = take_snapshot()
+            self._base = tracemalloc.get_traced_memory()[0]
+
+    def wrap(self, func):
+        """Return wrapper for func that profiles it when run in a worker
+           thread, so its time is attributed to the current cloud."""
+        if not _PER_THREAD:
+            return func
+
+        def profiled(*args, **kwargs):
+            "Run func with its own thread-local profiler"
+            prof = cProfile.Profile()
+            prof.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                prof.disable()
+                with self._lock:
+                    self._thread_profs.append(prof)
+        return profiled
+
+    def run(self, cnm, func, *args):
+        "Call func(*args) under the profiler, store results for cloud cnm"
+        self._thread_profs = []
+        if self.trace_mem:
+            start_snap = take_snapshot()
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            return func(*args)
+        finally:
+            prof.disable()
+            # Record memory before our own post-processing allocates
+            if self.trace_mem:
+                _, peak = tracemalloc.get_traced_memory()
+                self.peak = max(self.peak, peak)
+                self.write_mem(cnm, peak - base, take_snapshot(), start_snap)
+            # Only keep the file, so later clouds' memory is not skewed
+            self.write_stats(cnm, pstats.Stats(prof, *self._thread_profs))
+            self._thread_profs = []
+            self._pstats_files.append(os.path.join(self.outdir, cnm + ".pstats"))
+
+    def write_stats(self, fnm, stats):
+        "Write pstats and collapsed stack files DIR/fnm.*"
+        base = os.path.join(self.outdir, fnm)
+        stats.dump_stats(base + ".pstats")
+        with open(base + ".collapsed", "w", encoding="UTF-8") as ofile:
+            for line in collapsed_stacks(stats):
+                print(line, file=ofile)
+
+    def write_mem(self, fnm, peak, snap, start_snap):
+        """Write tracemalloc peak growth and top allocation sites grown
+           between start_snap and snap to DIR/fnm.mem.txt"""
+        with open(os.path.join(self.outdir, fnm + ".mem.txt"), "w",
+                  encoding="UTF-8") as ofile:
+            print(f"# Peak traced memory growth: {peak} bytes", file=ofile)
+            print(f"# Top {TOP_ALLOCS} allocation sites", file=ofile)
+            for stat in snap.compare_to(start_snap, "lineno")[:TOP_ALLOCS]:
+                print(stat, file=ofile)
+
+    def finish(self):
+        "Write aggregate results for the whole run"
+        if self.trace_mem:
+            self.write_mem("openstacksrv2ssh", self.peak - self._base,
+                           take_snapshot(), self._start_snap)
+            tracemalloc.stop()
+        if self._pstats_files:
+            self.write_stats("openstacksrv2ssh", pstats.Stats(*self._pstats_files))
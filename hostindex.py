@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# vim: set ts=4 sw=4 et:
+#
+# hostindex.py
+#
+# Local sqlite index of the generated ssh Host entries for fast lookups
+#
+# (c) Kurt Garloff <kurt@garloff.de>, 1/2023
+# SPDX-License-Identifier: Apache-2.0
+
+"""hostindex maintains ~/.ssh/openstacksrv2ssh.idx, a sqlite database
+   with the Host entries written to the .sshcfg files, so single hosts
+   can be looked up quickly without talking to OpenStack.
+   update_index() replaces the entries of one .sshcfg file,
+   remove_projects() drops the per-project entries of a cloud,
+   add_host() adds (or replaces) a single entry, hostnames() returns
+   the addresses known for a cloud, lookup() returns
+   an SSHhost object and candidates() the (cloud, cfgname) pairs
+   a host name might belong to."""
+
+import os
+import sys
+import sqlite3
+import sshhosts
+
+_home = os.environ["HOME"]
+INDEX_FILE = f"{_home}/.ssh/openstacksrv2ssh.idx"
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS hosts (
+    name TEXT PRIMARY KEY,
+    cloud TEXT NOT NULL,
+    cfgname TEXT NOT NULL,
+    hostname TEXT,
+    user TEXT,
+    id_file TEXT,
+    fwd_agent INTEGER,
+    misc TEXT)"""
+_INSERT = """INSERT OR REPLACE INTO hosts
+    (name, cloud, cfgname, hostname, user, id_file, fwd_agent, misc)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+
+def open_index(fnm=INDEX_FILE):
+    "Open (and create if needed) the index database"
+    dbconn = sqlite3.connect(fnm)
+    dbconn.execute(_SCHEMA)
+    # Index files written before misc was stored
+    columns = [col[1] for col in dbconn.execute("PRAGMA table_info(hosts)")]
+    if "misc" not in columns:
+        dbconn.execute("ALTER TABLE hosts ADD COLUMN misc TEXT")
+    return dbconn
+
+def _row(cnm, cfgnm, shost):
+    "Index row for SSHhost shost from cloud cnm in file for cfgnm"
+    return (shost.name, cnm, cfgnm, shost.hostname, shost.user,
+            shost.id_file, int(shost.fwd_agent), shost.misc)
+
+def update_index(cnm, cfgnm, shosts, fnm=INDEX_FILE):
+    "Replace all entries for cfgnm (from cloud cnm) by the SSHhost list shosts"
+    dbconn = open_index(fnm)
+    with dbconn:
+        dbconn.execute("DELETE FROM hosts WHERE cfgname = ?", (cfgnm,))
+        dbconn.executemany(_INSERT, [_row(cnm, cfgnm, shost) for shost in shosts])
+    dbconn.close()
+
+def add_host(cnm, cfgnm, shost, fnm=INDEX_FILE):
+    "Add or replace a single SSHhost entry shost"
+    dbconn = open_index(fnm)
+    with dbconn:
+        dbconn.execute(_INSERT, _row(cnm, cfgnm, shost))
+    dbconn.close()
+
+def remove_projects(cnm, fnm=INDEX_FILE):
+    "Remove the per-project entries of cloud cnm written in --all-projects mode"
+    if not os.access(fnm, os.R_OK):
+        return
+    dbconn = open_index(fnm)
+    with dbconn:
+        dbconn.execute("DELETE FROM hosts WHERE cloud = ? AND cfgname != ?", (cnm, cnm))
+    dbconn.close()
+
+def hostnames(cnm, fnm=INDEX_FILE):
+    "Return list of Hostname values known for cloud cnm"
+    if not os.access(fnm, os.R_OK):
+        return []
+    dbconn = open_index(fnm)
+    rows = dbconn.execute("SELECT hostname FROM hosts WHERE cloud = ?", (cnm,)).fetchall()
+    dbconn.close()
+    return [row[0] for row in rows if row[0]]
+
+def lookup(name, fnm=INDEX_FILE):
+    "Return SSHhost object for Host name from the index, None if not found"
+    if not os.access(fnm, os.R_OK):
+        return None
+    dbconn = open_index(fnm)
+    row = dbconn.execute("SELECT name, hostname, user, id_file, fwd_agent, misc FROM hosts "
+                         "WHERE name = ?", (name,)).fetchone()
+    dbconn.close()
+    if not row:
+        return None
+    shost = sshhosts.SSHhost()
+    shost.name, shost.hostname, shost.user, shost.id_file = row[:4]
+    shost.fwd_agent = bool(row[4])
+    shost.misc = row[5] or ""
+    return shost
+
+def candidates(name, clouds=(), fnm=INDEX_FILE):
+    """Return list of (cloud, cfgname) tuples Host name may belong to,
+       i.e. where name starts with cfgname-. Pairs known from the index
+       come first, then the passed cloud names; longest match first."""
+    pairs = []
+    if os.access(fnm, os.R_OK):
+        dbconn = open_index(fnm)
+        pairs = dbconn.execute("SELECT DISTINCT cloud, cfgname FROM hosts").fetchall()
+        dbconn.close()
+    pairs = sorted([pair for pair in pairs if name.startswith(pair[1] + "-")],
+                   key=lambda pair: len(pair[1]), reverse=True)
+    for cnm in sorted(clouds, key=len, reverse=True):
+        if name.startswith(cnm + "-") and (cnm, cnm) not in pairs:
+            pairs.append((cnm, cnm))
+    return pairs
+
+
+def main(argv):
+    "Entry point for testing"
+    for name in argv:
+        shost = lookup(name)
+        if shost:
+            print(f"{shost}\n")
+        else:
+            print(f"#{name} not found, candidates: {candidates(name)}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
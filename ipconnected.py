@@ -17,7 +17,6 @@
 #import os
 import sys
 import json
-import requests
 #import openstack
 
 Subnet_Names = {}
@@ -25,8 +24,10 @@ Subnet_IDs = {}
 Subnet_Net = {}
 Network_IDs = {}
 
-def fill_subnetmap(conn):
-    "Create maps for subnet ID->name and name->ID"
+def fill_subnetmap(conn, project_id=None):
+    """Create maps for subnet ID->name and name->ID.
+       If project_id is passed (admin connections seeing all projects),
+       networks of that project win over same-named ones of others."""
     #global Subnet_Names, Subnet_IDs
     for subnet in conn.network.subnets():
         Subnet_Names[subnet.id] = subnet.name
@@ -34,16 +35,20 @@ def fill_subnetmap(conn):
         if subnet.ip_version == 4:
             Subnet_Net[subnet.network_id] = subnet.id
     for net in conn.network.networks():
+        if project_id and net.name in Network_IDs and net.project_id != project_id:
+            continue
         Network_IDs[net.name] = net.id
 
 
 class OwnNetInfo:
     """The subnets we are connected to"""
-    def __init__(self, conn):
+    def __init__(self, conn, project_id=None):
         self.subnets = []
         self.subnet_names = []
         self.nets = []
         self.net_names = []
+        # Imported here to keep lookups that don't need it fast
+        import requests
         try:
             ans = requests.get("http://169.254.169.254/openstack/latest/network_data.json",
                                 timeout=3)
@@ -51,7 +56,7 @@ class OwnNetInfo:
             return
         if not ans.ok:
             return
-        fill_subnetmap(conn)
+        fill_subnetmap(conn, project_id)
         jnet = json.loads(ans.text)
         for net in jnet["networks"]:
             net_id = net["network_id"]
@@ -121,18 +126,23 @@ def is_public(ipstr):
             return False
     return True
 
-def ownnet_and_routers(conn, debug=False):
+def ownnet_and_routers(conn, debug=False, project_id=None):
     """Check for own connectivity and connected routers.
         If we are on a cloud, we may have internal connections,
         and need to look at routers to understand them.
+        project_id restricts the routers (and network name lookups)
+        to that project, for admin connections that see all projects.
         Return OwnNetInfo and Router list."""
-    ownnet = OwnNetInfo(conn)
+    ownnet = OwnNetInfo(conn, project_id)
     if debug:
         print(f"We are connected to subnets {ownnet.subnet_names}", file=sys.stderr)
     if not ownnet.subnets:
         return(None, (None,))
     routers = []
-    for router in conn.network.routers():
+    filters = {}
+    if project_id:
+        filters['project_id'] = project_id
+    for router in conn.network.routers(**filters):
         rtr = Router(conn, router, debug)
         # filter only routers connected to us
         for subnet in ownnet.subnets:
@@ -14,8 +14,9 @@
 import os
 import sys
 import getopt
-import openstack
+import concurrent.futures
 import sshhosts
+import hostindex
 import servers
 import allclouds
 import ipconnected
@@ -23,10 +24,19 @@ import ipconnected
 def usage():
     "Help"
     print("Usage: openstacksrv2ssh.py [options] -a | [ENV [ENV [...]]]")
+    print("       openstacksrv2ssh.py [options] lookup NAME")
     print("Creates ~/.ssh/ENV.sshcfg files from OpenStack server lists.")
+    print("lookup NAME prints the Host entry NAME from the index ~/.ssh/openstacksrv2ssh.idx,")
+    print(" on a miss the server is fetched from its cloud and added to the index.")
     print("-a (or --all) iterates over all cloud configs known and also generates")
     print(" ~/.ssh/openstacksrv.sshcfg referencing all non-empty ones.")
+    print("-A (or --all-projects) lists the servers of all projects in ENV (admin only),")
+    print(" writes ~/.ssh/ENV-PROJECT.sshcfg files with ENV-PROJECT-VM host names")
+    print(" and ~/.ssh/ENV.sshcfg referencing all non-empty ones.")
     print("If OS_CLOUD is set and no ENV passed, it will be used.")
+    print("--profile DIR writes cProfile stats and collapsed stacks per cloud and for")
+    print(" the whole run to DIR, --profile-mem also records tracemalloc peak and top")
+    print(" allocation sites there.")
     print("Options: -v/--verbose, -d/--debug, -q/--quiet and -h/--help.")
     return 1
 
@@ -37,6 +47,8 @@ _nametempl = "%1s-%2s"
 DEBUG = False
 VERBOSE = False
 QUIET = False
+ALLPROJECTS = False
+PROFILER = None
 
 def find_by_name(srch, lst):
     "Search list lst for a .name == srch), return idx, -1 if not found."
@@ -74,14 +86,15 @@ def ssh_host_from_srv(osrv, ipaddr, oconn, sshnm=None):
         return shost
     return None
 
-def write_sshcfg(cnm, shosts):
-    "Write out ssh cfg file with hosts for cloud cnm"
-    sshfn = _cfgtempl % cnm
+def write_sshcfg(cfgnm, shosts, cnm):
+    "Write out ssh cfg file cfgnm with hosts for cloud cnm and update index"
+    sshfn = _cfgtempl % cfgnm
     sshcf = open(sshfn, "w", encoding="UTF-8")
     print("# SSH config file written by openstacksrv2ssh.py", file=sshcf)
-    print(f"# Hosts from cloud {cnm}\n", file=sshcf)
+    print(f"# Hosts from cloud {cfgnm}\n", file=sshcf)
     for shost in shosts:
         print(f"{shost}\n", file=sshcf)
+    hostindex.update_index(cnm, cfgnm, shosts)
     if not QUIET and len(shosts):
         print(f"{len(shosts)} entries written to {sshfn}")
 
@@ -99,8 +112,25 @@ def write_allsshcfg(fnames):
     if not QUIET:
         print(f"{len(fnames)} files included in ~/.ssh/openstacksrv2ssh.sshcfg")
 
+def write_projsshcfg(cnm, fnames):
+    "Write out ssh cfg file for cloud cnm including the per-project files"
+    # Hosts from a previous run without --all-projects are gone
+    hostindex.update_index(cnm, cnm, [])
+    if not fnames:
+        return
+    with open(_cfgtempl % cnm, "w", encoding='UTF-8') as ofile:
+        print("# SSH config file including per-project host list files", file=ofile)
+        print(f"# for cloud {cnm} written by openstacksrv2ssh.py --all-projects, "
+              "don't change as it will be overwritten", file=ofile)
+        for fnm in fnames:
+            print(f"Include {fnm}", file=ofile)
+    if not QUIET:
+        print(f"{len(fnames)} project files included in {_cfgtempl % cnm}")
+
 def connect(cnm):
     "Try to establish an authorized connection to cloud cnm"
+    # Only import the SDK when needed, so lookup stays fast
+    import openstack
     if VERBOSE:
         print(f"Connecting to cloud env {cnm}")
     try:
@@ -124,9 +154,9 @@ def connect(cnm):
     return conn
 
 
-def process_cloud(cnm):
-    "Iterate over all servers in cloud and return list of SSHhost objects"
-    sshfn = _cfgtempl % cnm
+def read_sshcfg(cfgnm):
+    "Parse existing ssh cfg file for cfgnm and return list of SSHhost objects"
+    sshfn = _cfgtempl % cfgnm
     ssh_hosts = []
     if os.access(sshfn, os.R_OK):
         ssh_hosts = sshhosts.collect_sshhosts(sshfn)
@@ -135,15 +165,16 @@ def process_cloud(cnm):
     else:
         if DEBUG:
             print(f"No ssh hosts in {sshfn}", file=sys.stderr)
-    conn = connect(cnm)
-    if not conn:
-        return 0
-    os_servers = servers.collect_servers(conn)
-    ownnet, routers = ipconnected.ownnet_and_routers(conn, DEBUG)
+    return ssh_hosts
+
+
+def update_hosts(cnm, cfgnm, ssh_hosts, os_servers, conn, ownnet, routers):
+    """Merge os_servers from cloud cnm into the ssh_hosts read from the
+       ssh cfg file for cfgnm, write it out and return the number of hosts."""
     # Add / correct OpenStack servers
     for srv in os_servers:
         ipaddr = ipconnected.preferred_ip(srv.ipaddrs, ownnet, routers, DEBUG)
-        sshnm = _nametempl % (cnm, srv.name)
+        sshnm = _nametempl % (cfgnm, srv.name)
         idx = find_by_name(sshnm, ssh_hosts)
         if DEBUG:
             print(f"OpenStack Server {sshnm} in ssh list: {idx}, IP {ipaddr}")
@@ -156,28 +187,223 @@ def process_cloud(cnm):
             fill_values(host, sshnm, srv, ipaddr, conn)
     # Remove servers that no longer exist
     for shost in ssh_hosts:
-        shortnm = shost.name[len(cnm)+1:]
+        shortnm = shost.name[len(cfgnm)+1:]
         if find_by_name(shortnm, os_servers) == -1:
             if DEBUG:
                 print(f"Remove {shost.name} ({shortnm}) as it's not in OpenStack server list",
                       file=sys.stderr)
             ssh_hosts.remove(shost)
     if VERBOSE:
-        print(f"# Servers from cloud {cnm}")
+        print(f"# Servers from {cfgnm}")
         for shost in ssh_hosts:
             print(f"{shost}\n")
     if len(ssh_hosts) != 0:
-        write_sshcfg(cnm, ssh_hosts)
+        write_sshcfg(cfgnm, ssh_hosts, cnm)
+    else:
+        hostindex.update_index(cnm, cfgnm, [])
     return len(ssh_hosts)
 
 
+def _task(func):
+    "Wrap func for profiling in worker threads if --profile is active"
+    if PROFILER:
+        return PROFILER.wrap(func)
+    return func
+
+
+def process_project(cnm, pool):
+    """Process the servers in the project of cloud cnm, return number of
+       SSHhost objects. The existing file is parsed during authorization,
+       server list and network topology are collected concurrently."""
+    hosts_fut = pool.submit(_task(read_sshcfg), cnm)
+    conn = connect(cnm)
+    if not conn:
+        return 0
+    # Hosts from a previous run with --all-projects are gone
+    hostindex.remove_projects(cnm)
+    srv_fut = pool.submit(_task(servers.collect_servers), conn)
+    topo_fut = pool.submit(_task(ipconnected.ownnet_and_routers), conn, DEBUG)
+    os_servers = srv_fut.result()
+    ownnet, routers = topo_fut.result()
+    return update_hosts(cnm, cnm, hosts_fut.result(), os_servers, conn, ownnet, routers)
+
+
+def project_cfgnames(cnm, projects):
+    """Map the project IDs in projects (ID->name) to names cnm-PROJECT.
+       Project names are only unique per domain; duplicates use the ID."""
+    counts = {}
+    for projnm in projects.values():
+        counts[projnm] = counts.get(projnm, 0) + 1
+    cfgnames = {}
+    for proj_id, projnm in projects.items():
+        if counts[projnm] > 1:
+            projnm = proj_id
+        cfgnames[proj_id] = f"{cnm}-{projnm}"
+    return cfgnames
+
+
+def process_all_projects(cnm, pool):
+    """Process the servers in all projects of cloud cnm (admin mode),
+       writing one file per project, return number of SSHhost objects.
+       Server list, network topology and project names are collected
+       concurrently, the existing per-project files are parsed as soon
+       as the project names are known."""
+    conn = connect(cnm)
+    if not conn:
+        return 0
+    own_project = conn.current_project_id
+    srv_fut = pool.submit(_task(servers.collect_servers), conn, all_projects=True)
+    topo_fut = pool.submit(_task(ipconnected.ownnet_and_routers), conn, DEBUG, own_project)
+    proj_fut = pool.submit(_task(servers.project_names), conn)
+    projects, exc = proj_fut.result()
+    if exc:
+        if not QUIET:
+            print(f"Could not retrieve project list of cloud {cnm}, "
+                  "using project IDs as names", file=sys.stderr)
+        if VERBOSE:
+            print(f"{exc}", file=sys.stderr)
+    cfgnames = project_cfgnames(cnm, projects)
+    hosts_futs = {}
+    for proj_id, cfgnm in cfgnames.items():
+        hosts_futs[proj_id] = pool.submit(_task(read_sshcfg), cfgnm)
+    try:
+        os_servers = srv_fut.result()
+    except Exception as exc:
+        if not QUIET:
+            print(f"No admin rights to list all projects' servers in cloud {cnm}",
+                  file=sys.stderr)
+        if VERBOSE:
+            print(f"{exc}", file=sys.stderr)
+        return 0
+    ownnet, routers = topo_fut.result()
+    # Sort servers by project and write one file per project
+    by_cfgnm = {}
+    for srv in os_servers:
+        cfgnm = cfgnames.get(srv.project_id, f"{cnm}-{srv.project_id}")
+        by_cfgnm.setdefault(cfgnm, (srv.project_id, []))[1].append(srv)
+    processed = 0
+    projhostfiles = []
+    for cfgnm, (proj_id, proj_servers) in sorted(by_cfgnm.items()):
+        if proj_id in hosts_futs:
+            ssh_hosts = hosts_futs[proj_id].result()
+        else:
+            ssh_hosts = read_sshcfg(cfgnm)
+        # Networks are matched by name, so we only use fixed IPs in our own
+        # project; other projects' servers get floating or public IPs
+        if proj_id == own_project:
+            thisproj = update_hosts(cnm, cfgnm, ssh_hosts, proj_servers, conn, ownnet, routers)
+        else:
+            thisproj = update_hosts(cnm, cfgnm, ssh_hosts, proj_servers, conn, None, None)
+        processed += thisproj
+        if thisproj:
+            projhostfiles.append(_cfgtempl % cfgnm)
+    write_projsshcfg(cnm, projhostfiles)
+    return processed
+
+
+def process_cloud(cnm):
+    "Iterate over all servers in cloud and return number of SSHhost objects"
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+        if ALLPROJECTS:
+            return process_all_projects(cnm, pool)
+        return process_project(cnm, pool)
+
+
+def uses_fixed_ips(cnm):
+    "Are private IPv4 addresses among the Hostnames indexed for cloud cnm?"
+    for hostname in hostindex.hostnames(cnm):
+        octets = hostname.split(".")
+        if len(octets) == 4 and all(map(str.isdigit, octets)) \
+                and not ipconnected.is_public(hostname):
+            return True
+    return False
+
+
+def find_project_server(conn, cnm, name):
+    """Find server for Host name cnm-PROJECT-VM in project PROJECT of cloud
+       cnm (admin only), trying all ways to split PROJECT-VM.
+       Return (cfgnm, OStackServer object) or (None, None)."""
+    rest = name[len(cnm)+1:]
+    idx = rest.find("-")
+    while idx > 0:
+        projnm = rest[:idx]
+        idx = rest.find("-", idx+1)
+        try:
+            proj = conn.identity.find_project(projnm, ignore_missing=True)
+        except Exception as exc:
+            if DEBUG:
+                print(f"Project lookup for {projnm} failed: {exc}", file=sys.stderr)
+            continue
+        if not proj:
+            continue
+        srv = servers.find_server(conn, rest[len(projnm)+1:], proj.id)
+        if srv:
+            return f"{cnm}-{projnm}", srv
+    return None, None
+
+
+def fetch_host(name):
+    """Fetch the single server for ssh Host name from its cloud,
+       add it to the index and return SSHhost object or None."""
+    for cnm, cfgnm in hostindex.candidates(name, allclouds.collectallclouds()):
+        conn = connect(cnm)
+        if not conn:
+            continue
+        if cfgnm == cnm:
+            srv = servers.find_server(conn, name[len(cnm)+1:])
+            if not srv:
+                # May be in another project (--all-projects mode)
+                cfgnm, srv = find_project_server(conn, cnm, name)
+        else:
+            srv = None
+            try:
+                proj = conn.identity.find_project(cfgnm[len(cnm)+1:], ignore_missing=True)
+                if proj:
+                    srv = servers.find_server(conn, name[len(cfgnm)+1:], proj.id)
+            except Exception as exc:
+                if DEBUG:
+                    print(f"Project lookup for {cfgnm} failed: {exc}", file=sys.stderr)
+        if not srv:
+            continue
+        # Only do the expensive topology lookup if the last sweep found us
+        # inside this cloud (private addresses) and the server is ours
+        ownnet, routers = None, None
+        if srv.project_id == conn.current_project_id and uses_fixed_ips(cnm):
+            ownnet, routers = ipconnected.ownnet_and_routers(conn, DEBUG,
+                                                             conn.current_project_id)
+        ipaddr = ipconnected.preferred_ip(srv.ipaddrs, ownnet, routers, DEBUG)
+        shost = ssh_host_from_srv(srv, ipaddr, conn, name)
+        if shost:
+            hostindex.add_host(cnm, cfgnm, shost)
+        return shost
+    return None
+
+
+def lookup_host(name):
+    "Print Host entry for name from index, fetch it from OpenStack on a miss"
+    shost = hostindex.lookup(name)
+    if not shost:
+        if DEBUG:
+            print(f"{name} not in index, querying OpenStack", file=sys.stderr)
+        shost = fetch_host(name)
+    if not shost:
+        if not QUIET:
+            print(f"Host {name} not found", file=sys.stderr)
+        return 1
+    print(shost)
+    return 0
+
+
 def main(argv):
     "Entry point for main program"
     doall = False
-    global DEBUG, VERBOSE, QUIET
+    profdir = None
+    profmem = False
+    global DEBUG, VERBOSE, QUIET, ALLPROJECTS, PROFILER
     try:
-        optlist, args = getopt.gnu_getopt(argv, "havdq",
-            ("help", "all", "verbose", "debug", "quiet"))
+        optlist, args = getopt.gnu_getopt(argv, "haAvdq",
+            ("help", "all", "all-projects", "verbose", "debug", "quiet",
+             "profile=", "profile-mem"))
     except getopt.GetoptError as exc:
         print("Error:", exc, file=sys.stderr)
         return usage()
@@ -187,14 +413,24 @@ def main(argv):
             sys.exit(0)
         elif opt[0] =="-a" or opt[0] == "--all":
             doall = True
+        elif opt[0] =="-A" or opt[0] == "--all-projects":
+            ALLPROJECTS = True
         elif opt[0] =="-v" or opt[0] == "--verbose":
             VERBOSE = True
         elif opt[0] =="-d" or opt[0] == "--debug":
             DEBUG = True
         elif opt[0] =="-q" or opt[0] == "--quiet":
             QUIET = True
+        elif opt[0] == "--profile":
+            profdir = opt[1]
+        elif opt[0] == "--profile-mem":
+            profmem = True
         else:
             raise RuntimeError("option parser error")
+    if args and args[0] == "lookup":
+        if len(args) != 2:
+            return usage()
+        return lookup_host(args[1])
     if not doall and not args:
         if "OS_CLOUD" in os.environ:
             args = (os.environ["OS_CLOUD"],)
@@ -202,15 +438,27 @@ def main(argv):
         sys.exit(usage())
     if doall:
         args = allclouds.collectallclouds()
+    if profmem and not profdir:
+        print("Error: --profile-mem requires --profile DIR", file=sys.stderr)
+        return usage()
+    if profdir:
+        # Only import profiling support when needed
+        import cloudprofile
+        PROFILER = cloudprofile.CloudProfiler(profdir, profmem)
     processed = 0
     cloudhostfiles = []
     for cloud in args:
-        thiscloud = process_cloud(cloud)
+        if PROFILER:
+            thiscloud = PROFILER.run(cloud, process_cloud, cloud)
+        else:
+            thiscloud = process_cloud(cloud)
         processed += thiscloud
         if thiscloud and allclouds:
             cloudhostfiles.append(_cfgtempl % cloud)
     if doall:
         write_allsshcfg(cloudhostfiles)
+    if PROFILER:
+        PROFILER.finish()
     if processed == 0:
         return 2
     return 0
@@ -18,7 +18,7 @@
 
 import sys
 import os
-import openstack
+import re
 
 class OStackServer:
     "class collecting infos about servers (VMs) from OpenStack"
@@ -26,6 +26,7 @@ class OStackServer:
         "default c'tor"
         self.uid = None
         self.name = None
+        self.project_id = None
         self.ipaddrs = []
         self.keypair = None
         self.flavor = None
@@ -36,6 +37,7 @@ class OStackServer:
            does not fill in usernm"""
         self.uid = srvlistentry.id
         self.name = srvlistentry.name
+        self.project_id = srvlistentry.project_id
         self.ipaddrs = srvlistentry.addresses
         self.keypair = srvlistentry.key_name
         self.flavor = srvlistentry.flavor["original_name"]
@@ -75,12 +77,16 @@ class OStackServer:
 		f"keypair={self.keypair}, flavor={self.flavor}, image={self.image}, " \
 		f"usernm={self.usernm}"
 
-def collect_servers(ostackconn, collectfull = False):
+def collect_servers(ostackconn, collectfull = False, all_projects = False):
     """Uses ostackconn to get server list and returns a list of
        OStackServer objects. collectfull controls whether we also
-       do image API calls to get user names."""
+       do image API calls to get user names. all_projects lists the
+       servers of all projects (requires admin rights)."""
     servers = []
-    for srv in ostackconn.compute.servers():
+    filters = {}
+    if all_projects:
+        filters['all_projects'] = True
+    for srv in ostackconn.compute.servers(**filters):
         if srv.status != "ACTIVE":
             continue
         osrv = OStackServer()
@@ -90,8 +96,34 @@ def collect_servers(ostackconn, collectfull = False):
         servers.append(osrv)
     return servers
 
+def find_server(ostackconn, name, project_id=None):
+    """Uses ostackconn to look up a single active server by name,
+       returns an OStackServer object or None. If project_id is
+       passed, the server is searched in that project (admin only)."""
+    filters = {'name': f"^{re.escape(name)}$"}
+    if project_id:
+        filters['all_projects'] = True
+        filters['project_id'] = project_id
+    for srv in ostackconn.compute.servers(**filters):
+        if srv.status == "ACTIVE" and srv.name == name:
+            return OStackServer().collectinfo(srv)
+    return None
+
+def project_names(ostackconn):
+    """Returns a dict mapping project IDs to names, using a single
+       Keystone project listing, and the exception if the listing
+       failed (then the dict is empty)."""
+    projects = {}
+    try:
+        for proj in ostackconn.identity.projects():
+            projects[proj.id] = proj.name
+    except Exception as exc:
+        return {}, exc
+    return projects, None
+
 def main(argv):
     "main entry point for testing"
+    import openstack
     cloud = None
     if "OS_CLOUD" in os.environ:
         cloud = os.environ["OS_CLOUD"]